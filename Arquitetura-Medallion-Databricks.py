@@ -362,7 +362,7 @@
 # COMMAND ----------
 
 # MAGIC %sql 
-# MAGIC -- Célula Final: Materialização da Tabela Gold
+# MAGIC -- Célula 4: Materialização da Tabela Gold
 # MAGIC -- Objetivo: Executar todo o pipeline de transformação e salvar o resultado
 # MAGIC -- em uma tabela de análise final (camada Gold). Esta tabela será a fonte
 # MAGIC -- de dados para relatórios, dashboards e outras análises.
@@ -667,9 +667,431 @@
 # MAGIC SELECT *
 # MAGIC FROM
 # MAGIC   dados_renomeados;
-# MAGIC -- Célula Final: Materialização da Tabela Gold
+# MAGIC -- Célula 4: Materialização da Tabela Gold
 # MAGIC -- Objetivo: Executar todo o pipeline de transformação e salvar o resultado
 # MAGIC -- em uma tabela de análise final (camada Gold). Esta tabela será a fonte
 # MAGIC -- de dados para relatórios, dashboards e outras análises.
 # MAGIC
 # MAGIC SELECT * from gold_ifood;
+
+# COMMAND ----------
+
+# MAGIC %sql
+# MAGIC -- Célula 5: Validação de Regressão - Escolha das Versões da Tabela Gold
+# MAGIC -- Objetivo: Definir quais versões da 'gold_ifood' serão comparadas após uma mudança
+# MAGIC -- nos mapeamentos (CASE) ou na lógica de receita/desconto/lucro.
+# MAGIC -- Como a tabela é Delta, cada execução do CREATE OR REPLACE gera uma nova versão,
+# MAGIC -- que pode ser lida com versionAsOf sem precisar manter cópias da tabela.
+# MAGIC -- Com os widgets vazios, a próxima célula compara a última versão com a anterior.
+# MAGIC
+# MAGIC CREATE WIDGET TEXT versao_base DEFAULT '';  -- Versão antes da mudança nas regras
+# MAGIC
+# MAGIC CREATE WIDGET TEXT versao_nova DEFAULT '';  -- Versão depois da mudança nas regras
+# MAGIC
+# MAGIC -- Histórico de versões para consultar o número de cada materialização.
+# MAGIC DESCRIBE HISTORY gold_ifood;
+
+# COMMAND ----------
+
+# Célula 6: Validação de Regressão - Leitura das Versões Comparadas
+# Objetivo: Resolver as versões escolhidas nos widgets e expor cada uma como uma view temporária.
+# Na primeira execução só existe a versão 0, que é comparada com ela mesma e não gera diferenças.
+# As células seguintes comparam as colunas por posição (UNION ALL / EXCEPT ALL), então as duas
+# versões precisam ter o mesmo esquema; se uma mudança de regra alterou as colunas, a validação para aqui.
+
+versoes = [linha["version"] for linha in spark.sql("DESCRIBE HISTORY gold_ifood").select("version").collect()]
+
+versao_nova = int(dbutils.widgets.get("versao_nova") or max(versoes))
+versao_base = int(dbutils.widgets.get("versao_base") or max([v for v in versoes if v < versao_nova], default=versao_nova))
+
+gold_base = spark.read.option("versionAsOf", versao_base).table("gold_ifood")
+gold_nova = spark.read.option("versionAsOf", versao_nova).table("gold_ifood")
+
+# Compara nome e tipo de cada coluna, na ordem; diferenças só de nulabilidade não afetam os checksums.
+colunas_base = [(campo.name, campo.dataType) for campo in gold_base.schema]
+colunas_nova = [(campo.name, campo.dataType) for campo in gold_nova.schema]
+
+if colunas_base != colunas_nova:
+    raise ValueError(
+        f"O esquema da gold_ifood mudou entre as versões {versao_base} e {versao_nova}; "
+        f"a comparação por checksums exige as mesmas colunas na mesma ordem.\n"
+        f"Base: {gold_base.schema.simpleString()}\n"
+        f"Nova: {gold_nova.schema.simpleString()}"
+    )
+
+gold_base.createOrReplaceTempView("gold_versao_base")
+gold_nova.createOrReplaceTempView("gold_versao_nova")
+
+print(f"Comparando a versão {versao_base} (base) com a versão {versao_nova} (nova) da gold_ifood")
+
+# COMMAND ----------
+
+# MAGIC %sql
+# MAGIC -- Célula 7: Validação de Regressão - Checksums por Partição
+# MAGIC -- Objetivo: Resumir cada partição (data_venda, id_restaurante) das duas versões em uma única linha
+# MAGIC -- com contagem, somas dos valores e um hash agregado das linhas.
+# MAGIC -- O hash de cada linha é somado (e não concatenado), então o resultado não depende da ordem das linhas.
+# MAGIC -- Assim, comparamos poucas linhas de resumo em vez de fazer um EXCEPT sobre a tabela inteira.
+# MAGIC
+# MAGIC -- xxhash64(*) calcula o hash sobre todas as colunas da Gold; a Célula 6 já garantiu que as duas versões têm o mesmo esquema.
+# MAGIC CREATE OR REPLACE TEMPORARY VIEW gold_checksums AS
+# MAGIC With versoes AS (
+# MAGIC   SELECT 'base' AS versao, xxhash64(*) AS hash_linha, * FROM gold_versao_base
+# MAGIC
+# MAGIC   UNION ALL
+# MAGIC
+# MAGIC   SELECT 'nova' AS versao, xxhash64(*) AS hash_linha, * FROM gold_versao_nova
+# MAGIC )
+# MAGIC
+# MAGIC SELECT
+# MAGIC   versao,
+# MAGIC
+# MAGIC   data_venda,
+# MAGIC
+# MAGIC   id_restaurante,
+# MAGIC
+# MAGIC   COUNT(*) AS linhas,
+# MAGIC
+# MAGIC   SUM(receita) AS receita,
+# MAGIC
+# MAGIC   SUM(desconto) AS desconto,
+# MAGIC
+# MAGIC   SUM(lucro) AS lucro,
+# MAGIC
+# MAGIC   -- CAST para DECIMAL(38, 0) evita estouro ao somar os hashes de 64 bits.
+# MAGIC   SUM(CAST(hash_linha AS DECIMAL(38, 0))) AS hash_linhas
+# MAGIC
+# MAGIC FROM versoes
+# MAGIC
+# MAGIC GROUP BY versao, data_venda, id_restaurante;
+# MAGIC
+# MAGIC -- Partições que existem em só uma das versões ou cujo resumo mudou.
+# MAGIC -- O operador <=> compara também valores nulos (NULL <=> NULL é verdadeiro).
+# MAGIC CREATE OR REPLACE TEMPORARY VIEW gold_particoes_alteradas AS
+# MAGIC With base AS (SELECT * FROM gold_checksums WHERE versao = 'base'),
+# MAGIC
+# MAGIC nova AS (SELECT * FROM gold_checksums WHERE versao = 'nova')
+# MAGIC
+# MAGIC SELECT
+# MAGIC   COALESCE(b.data_venda, n.data_venda) AS data_venda,
+# MAGIC
+# MAGIC   COALESCE(b.id_restaurante, n.id_restaurante) AS id_restaurante,
+# MAGIC
+# MAGIC   b.linhas AS linhas_base,
+# MAGIC
+# MAGIC   n.linhas AS linhas_nova,
+# MAGIC
+# MAGIC   b.receita AS receita_base,
+# MAGIC
+# MAGIC   n.receita AS receita_nova,
+# MAGIC
+# MAGIC   b.lucro AS lucro_base,
+# MAGIC
+# MAGIC   n.lucro AS lucro_nova
+# MAGIC
+# MAGIC FROM base b
+# MAGIC
+# MAGIC FULL OUTER JOIN nova n
+# MAGIC   ON b.data_venda <=> n.data_venda
+# MAGIC   AND b.id_restaurante <=> n.id_restaurante
+# MAGIC
+# MAGIC WHERE NOT (
+# MAGIC   b.linhas <=> n.linhas
+# MAGIC   AND b.receita <=> n.receita
+# MAGIC   AND b.desconto <=> n.desconto
+# MAGIC   AND b.lucro <=> n.lucro
+# MAGIC   AND b.hash_linhas <=> n.hash_linhas
+# MAGIC );
+# MAGIC
+# MAGIC SELECT * FROM gold_particoes_alteradas ORDER BY data_venda, id_restaurante;
+
+# COMMAND ----------
+
+# MAGIC %sql
+# MAGIC -- Célula 8: Validação de Regressão - Linhas Alteradas
+# MAGIC -- Objetivo: Detalhar, linha a linha, apenas as partições apontadas na célula anterior.
+# MAGIC -- As demais lojas e datas já foram confirmadas como idênticas pelos checksums,
+# MAGIC -- então o EXCEPT ALL roda só sobre o pequeno conjunto de partições alteradas.
+# MAGIC -- Se nenhuma linha for retornada, a mudança não afetou a saída da camada Gold.
+# MAGIC
+# MAGIC CREATE OR REPLACE TEMPORARY VIEW gold_linhas_alteradas AS
+# MAGIC With base AS (
+# MAGIC   SELECT g.*
+# MAGIC   FROM gold_versao_base g
+# MAGIC   LEFT SEMI JOIN gold_particoes_alteradas p
+# MAGIC     ON g.data_venda <=> p.data_venda
+# MAGIC     AND g.id_restaurante <=> p.id_restaurante
+# MAGIC ),
+# MAGIC
+# MAGIC nova AS (
+# MAGIC   SELECT g.*
+# MAGIC   FROM gold_versao_nova g
+# MAGIC   LEFT SEMI JOIN gold_particoes_alteradas p
+# MAGIC     ON g.data_venda <=> p.data_venda
+# MAGIC     AND g.id_restaurante <=> p.id_restaurante
+# MAGIC )
+# MAGIC
+# MAGIC -- 'removida': linha que existia na versão base e não existe mais na nova.
+# MAGIC -- 'adicionada': linha que aparece apenas na versão nova.
+# MAGIC SELECT 'removida' AS tipo_alteracao, * FROM (SELECT * FROM base EXCEPT ALL SELECT * FROM nova)
+# MAGIC
+# MAGIC UNION ALL
+# MAGIC
+# MAGIC SELECT 'adicionada' AS tipo_alteracao, * FROM (SELECT * FROM nova EXCEPT ALL SELECT * FROM base);
+# MAGIC
+# MAGIC SELECT *
+# MAGIC FROM gold_linhas_alteradas
+# MAGIC ORDER BY data_venda, id_restaurante, id_pedido_loja, tipo_alteracao;
+
+# COMMAND ----------
+
+# MAGIC %sql
+# MAGIC -- Célula 9: Exportação Incremental para o Power BI - Parâmetros e Manifesto
+# MAGIC -- Objetivo: Preparar a exportação da 'gold_ifood' em arquivos Parquet particionados por data,
+# MAGIC -- para que o Power BI use atualização incremental em vez de reimportar a tabela inteira pelo SQL endpoint.
+# MAGIC -- O manifesto guarda o checksum de cada data já exportada para cada pasta de destino;
+# MAGIC -- só datas com checksum diferente (ou cuja pasta não existe mais) são reescritas.
+# MAGIC
+# MAGIC CREATE WIDGET TEXT caminho_export DEFAULT '/mnt/export/gold_ifood';  -- Pasta lida pelo Power BI
+# MAGIC
+# MAGIC -- Limite máximo de cada arquivo Parquet (não é um tamanho alvo): cada data vira um arquivo,
+# MAGIC -- que só é dividido quando passa desse limite.
+# MAGIC CREATE WIDGET TEXT tamanho_max_arquivo_mb DEFAULT '128';
+# MAGIC
+# MAGIC -- Uma linha por pasta de destino e data exportada: checksum, versão da Gold de origem e bytes gravados.
+# MAGIC CREATE TABLE IF NOT EXISTS gold_ifood_export_manifest (
+# MAGIC   caminho_export STRING,
+# MAGIC
+# MAGIC   data_venda DATE,
+# MAGIC
+# MAGIC   linhas BIGINT,
+# MAGIC
+# MAGIC   hash_linhas DECIMAL(38, 0),
+# MAGIC
+# MAGIC   versao_gold BIGINT,
+# MAGIC
+# MAGIC   bytes BIGINT,
+# MAGIC
+# MAGIC   exportado_em TIMESTAMP
+# MAGIC );
+# MAGIC
+# MAGIC -- Uma linha por execução da exportação, com o tempo gasto e o volume gravado.
+# MAGIC CREATE TABLE IF NOT EXISTS gold_ifood_export_log (
+# MAGIC   caminho_export STRING,
+# MAGIC
+# MAGIC   exportado_em TIMESTAMP,
+# MAGIC
+# MAGIC   versao_gold BIGINT,
+# MAGIC
+# MAGIC   particoes_reescritas BIGINT,
+# MAGIC
+# MAGIC   particoes_removidas BIGINT,
+# MAGIC
+# MAGIC   linhas_escritas BIGINT,
+# MAGIC
+# MAGIC   bytes_escritos BIGINT,
+# MAGIC
+# MAGIC   segundos DOUBLE
+# MAGIC );
+
+# COMMAND ----------
+
+# Célula 10: Exportação Incremental para o Power BI - Escrita dos Extratos Parquet
+# Objetivo: Comparar o checksum de cada data da 'gold_ifood' com o manifesto e reescrever
+# apenas as datas que mudaram desde a última exportação para a mesma pasta.
+# O checksum usa o mesmo hash por linha da Célula 7 (xxhash64 sobre todas as colunas da Gold),
+# somado por data, então não depende da ordem das linhas.
+# As pastas são particao_data=AAAA-MM-DD, uma cópia de data_venda: o Spark retira a coluna de partição
+# de dentro dos arquivos, e os conectores do Power BI não leem o nome das pastas. Assim, data_venda
+# continua em cada arquivo, junto com exportado_em, que muda sempre que a data é reescrita.
+# Linhas com data_venda nula (DATA ausente ou inválida na origem) ficam na pasta
+# particao_data=__HIVE_DEFAULT_PARTITION__ e são comparadas como qualquer outra data.
+
+import time
+from datetime import datetime
+
+from pyspark.sql import functions as F
+
+caminho_export = dbutils.widgets.get("caminho_export").rstrip("/")
+tamanho_max_arquivo_mb = int(dbutils.widgets.get("tamanho_max_arquivo_mb"))
+
+# Nome da pasta que o Spark usa para a partição de data nula.
+PARTICAO_NULA = "__HIVE_DEFAULT_PARTITION__"
+
+# Estimativa de bytes por linha usada enquanto o manifesto desta pasta não tem histórico (primeira exportação).
+# É só um ponto de partida para o limite de linhas por arquivo; depois vale a média real gravada no manifesto.
+BYTES_POR_LINHA_PADRAO = 64
+
+
+def nome_pasta(data):
+    return f"particao_data={PARTICAO_NULA if data is None else data}"
+
+
+def bytes_por_pasta():
+    # Uma única listagem recursiva da pasta de exportação, em vez de uma chamada por data.
+    raiz = spark._jvm.org.apache.hadoop.fs.Path(caminho_export)
+    sistema = raiz.getFileSystem(spark._jsc.hadoopConfiguration())
+    tamanhos = {}
+    if not sistema.exists(raiz):
+        return tamanhos
+    arquivos = sistema.listFiles(raiz, True)
+    while arquivos.hasNext():
+        arquivo = arquivos.next()
+        if arquivo.getPath().getName().endswith(".parquet"):
+            pasta = arquivo.getPath().getParent().getName()
+            tamanhos[pasta] = tamanhos.get(pasta, 0) + arquivo.getLen()
+    return tamanhos
+
+
+inicio = time.time()
+exportado_em = datetime.now()
+
+# Fixa a versão da Gold para que checksum e escrita leiam exatamente os mesmos dados.
+versao_gold = spark.sql("DESCRIBE HISTORY gold_ifood LIMIT 1").first()["version"]
+gold = spark.read.option("versionAsOf", versao_gold).table("gold_ifood")
+
+# Os checksums têm uma linha por dia, então cabem no driver: a Gold é lida uma vez aqui e outra na escrita.
+# Como chave de dicionário, None (data nula) se compara com ele mesmo, igual ao <=> do SQL.
+checksums = {
+    linha["data_venda"]: (linha["linhas"], linha["hash_linhas"])
+    for linha in gold.groupBy("data_venda")
+    .agg(
+        F.count("*").alias("linhas"),
+        F.sum(F.xxhash64(*gold.columns).cast("decimal(38,0)")).alias("hash_linhas"),
+    )
+    .collect()
+}
+
+# Só o manifesto desta pasta: apontar o widget para uma pasta nova começa uma exportação completa.
+manifesto = {
+    linha["data_venda"]: linha
+    for linha in spark.read.table("gold_ifood_export_manifest").filter(F.col("caminho_export") == caminho_export).collect()
+}
+
+pastas_existentes = bytes_por_pasta()
+
+# Datas novas, com checksum diferente do manifesto ou cuja pasta foi apagada precisam ser reescritas.
+datas_alteradas = [
+    data
+    for data, (linhas, hash_linhas) in checksums.items()
+    if data not in manifesto
+    or (manifesto[data]["linhas"], manifesto[data]["hash_linhas"]) != (linhas, hash_linhas)
+    or nome_pasta(data) not in pastas_existentes
+]
+
+# Datas que estão no manifesto mas não existem mais na Gold têm a pasta apagada.
+datas_removidas = [data for data in manifesto if data not in checksums]
+
+# Converte o limite de tamanho em linhas por arquivo usando o tamanho médio por linha das exportações anteriores.
+linhas_exportadas = sum(entrada["linhas"] for entrada in manifesto.values())
+bytes_por_linha = (
+    sum(entrada["bytes"] for entrada in manifesto.values()) / linhas_exportadas if linhas_exportadas else BYTES_POR_LINHA_PADRAO
+)
+linhas_por_arquivo = max(1, int(tamanho_max_arquivo_mb * 1024 * 1024 / bytes_por_linha))
+
+if datas_alteradas:
+    # isin ignora NULL, então a partição de data nula entra por uma condição separada.
+    filtro = F.col("data_venda").isin([data for data in datas_alteradas if data is not None])
+    if None in datas_alteradas:
+        filtro = filtro | F.col("data_venda").isNull()
+
+    # Com o modo dinâmico, o overwrite substitui só as pastas de data presentes no DataFrame.
+    # A opção vale só para esta escrita, sem alterar a configuração da sessão.
+    (
+        gold.filter(filtro)
+        .withColumn("exportado_em", F.lit(exportado_em))
+        .withColumn("particao_data", F.col("data_venda"))
+        .repartition("particao_data")
+        .write.mode("overwrite")
+        .option("partitionOverwriteMode", "dynamic")
+        .partitionBy("particao_data")
+        .option("compression", "zstd")
+        .option("maxRecordsPerFile", linhas_por_arquivo)
+        .parquet(caminho_export)
+    )
+
+for data in datas_removidas:
+    dbutils.fs.rm(f"{caminho_export}/{nome_pasta(data)}", True)
+
+tamanhos = bytes_por_pasta()
+bytes_por_data = {data: tamanhos.get(nome_pasta(data), 0) for data in datas_alteradas}
+
+novas_entradas = spark.createDataFrame(
+    [
+        (caminho_export, data, checksums[data][0], checksums[data][1], versao_gold, bytes_por_data[data], exportado_em)
+        for data in datas_alteradas
+    ],
+    schema=spark.read.table("gold_ifood_export_manifest").schema,
+)
+novas_entradas.createOrReplaceTempView("export_manifest_novo")
+
+spark.sql("""
+  MERGE INTO gold_ifood_export_manifest m
+  USING export_manifest_novo n
+    ON m.caminho_export = n.caminho_export
+    AND m.data_venda <=> n.data_venda
+  WHEN MATCHED THEN UPDATE SET *
+  WHEN NOT MATCHED THEN INSERT *
+""")
+
+if datas_removidas:
+    spark.createDataFrame(
+        [(caminho_export, data) for data in datas_removidas], "caminho_export STRING, data_venda DATE"
+    ).createOrReplaceTempView("export_manifest_removido")
+    spark.sql("""
+      MERGE INTO gold_ifood_export_manifest m
+      USING export_manifest_removido r
+        ON m.caminho_export = r.caminho_export
+        AND m.data_venda <=> r.data_venda
+      WHEN MATCHED THEN DELETE
+    """)
+
+segundos = time.time() - inicio
+
+spark.createDataFrame(
+    [
+        (
+            caminho_export,
+            exportado_em,
+            versao_gold,
+            len(datas_alteradas),
+            len(datas_removidas),
+            sum(checksums[data][0] for data in datas_alteradas),
+            sum(bytes_por_data.values()),
+            segundos,
+        )
+    ],
+    schema=spark.read.table("gold_ifood_export_log").schema,
+).write.mode("append").saveAsTable("gold_ifood_export_log")
+
+print(f"Versão da Gold exportada: {versao_gold}")
+print(f"Datas reescritas: {len(datas_alteradas)} | Datas removidas: {len(datas_removidas)}")
+print(f"Bytes escritos: {sum(bytes_por_data.values())} | Tempo: {segundos:.1f} s")
+
+# COMMAND ----------
+
+# MAGIC %sql
+# MAGIC -- Célula 11: Exportação Incremental para o Power BI - Medição por Atualização
+# MAGIC -- Objetivo: Acompanhar o tempo de exportação e o volume gravado em cada atualização.
+# MAGIC -- Depois da primeira carga completa, as execuções devem reescrever só as datas alteradas.
+# MAGIC
+# MAGIC SELECT
+# MAGIC   caminho_export,
+# MAGIC
+# MAGIC   exportado_em,
+# MAGIC
+# MAGIC   versao_gold,
+# MAGIC
+# MAGIC   particoes_reescritas,
+# MAGIC
+# MAGIC   particoes_removidas,
+# MAGIC
+# MAGIC   linhas_escritas,
+# MAGIC
+# MAGIC   ROUND(bytes_escritos / 1024 / 1024, 2) AS mb_escritos,
+# MAGIC
+# MAGIC   ROUND(segundos, 1) AS segundos
+# MAGIC
+# MAGIC FROM gold_ifood_export_log
+# MAGIC
+# MAGIC ORDER BY exportado_em DESC;